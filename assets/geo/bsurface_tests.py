@@ -1,10 +1,22 @@
-import os,json
+import os
+import orjson
+import h5py
+import functools
 import numpy as np
-import scipy.integrate as sci
-import random, math
+import math
 import matplotlib
 import matplotlib.pyplot as plt
 from mpl_toolkits.mplot3d import Axes3D
+try:
+    from numba import njit, prange
+except ImportError:
+    # without numba the kernels below run as plain (serial) Python
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda fn: fn
+
+    prange = range
 
 from geomdl import NURBS
 from geomdl import helpers
@@ -15,6 +27,7 @@ from geomdl import operations
 
 
 file_name = 'bsurface-tests.json'
+h5_file_name = 'bsurface-tests.h5'
 pmax = 5
 qmax = 6
 orders = [[1, 2], [2, 3], [3, 4], [4, 5], [5, 6]]
@@ -27,143 +40,103 @@ n_max = len(knots_v)
 s_max = n_max - 1 - qmax
 
 
-x_max = [0 for _ in range(r_max)]
-y_max = [0 for _ in range(s_max)]
-
-for i in range(r_max):
-    x_max[i] = float(i) +  random.uniform(-0.25, 0.25)
-
-for i in range(s_max):
-    y_max[i] = float(i)+  random.uniform(-0.25, 0.25)
+# fixed seed so that regenerating the fixtures is reproducible
+rng = np.random.default_rng(0)
+x_max = np.arange(r_max, dtype=np.float64) + rng.uniform(-0.25, 0.25, size=r_max)
+y_max = np.arange(s_max, dtype=np.float64) + rng.uniform(-0.25, 0.25, size=s_max)
 
-z_max = [0 for _ in range(r_max * s_max)]
-idx = 0
-for i in range(r_max):
-    for j in range(s_max):
-        idx = i * s_max + j
-        z_max[idx] = math.sin(x_max[i]) * math.cos(y_max[j])
+z_max = np.multiply.outer(np.sin(x_max), np.cos(y_max)).ravel()
 
-
-weights_max = [0 for _ in range(r_max * s_max)]
 wghtsu = [1.0, 1.5, 2.0, 1.5, 1.0, 1.5, 2.0, 1.5, 1.0, 1.5, 2.0, 1.5]
 wghtsv  = [1.0, 1.5, 2.0, 1.5, 1.0, 1.5, 2.0, 1.5, 1.0, 1.5, 2.0, 1.5, 1.0]
-ind = 0
-for i in range(r_max):
-    for j in range(s_max):
-        weights_max[ind] = wghtsu[i] * wghtsv[j]
-        ind = ind + 1
+weights_max = np.multiply.outer(np.asarray(wghtsu), np.asarray(wghtsv)).ravel()
 
+@functools.lru_cache(maxsize=None)
 def getKnotsU(p):
 
     knots = knots_u[(pmax - p) : (m_max - (pmax - p))]
-    return knots
+    return tuple(knots)
 
+@functools.lru_cache(maxsize=None)
 def getKnotsV(q):
 
     knots = knots_v[(qmax - q) : (n_max - (qmax - q))]
-    return knots
+    return tuple(knots)
 
-def getPoints(p, q, d):
+# knot vectors and control net size (r, s) of each surface order
+SURF_META = dict()
+for p, q in orders:
+    knotsu = np.asarray(getKnotsU(p), dtype=np.float64)
+    knotsv = np.asarray(getKnotsV(q), dtype=np.float64)
+    knotsu.setflags(write=False)
+    knotsv.setflags(write=False)
+    SURF_META[(p, q)] = (knotsu, knotsv, len(knotsu) - p - 1, len(knotsv) - q - 1)
 
-    knotsu = getKnotsU(p)
-    knotsv = getKnotsV(q)
-
-    m = len(knotsu)
-    r = m - p - 1
-
-    n = len(knotsv)
-    s = n - q - 1
-
-    x = x_max[0:r]
-    y = y_max[0:s]
-
-    if d == 2:
-        P = [[0 for _ in range(2)] for _ in range(r*s)]
-    elif d == 3:
-        P = [[0 for _ in range(3)] for _ in range(r*s)]
+def getPoints(p, q, d):
 
-    for i in range(r):
-        for j in range(s):
-            index = i + j * r # NOTE that this is column-major for topohedral
+    knotsu, knotsv, r, s = SURF_META[(p, q)]
 
-            if d == 2:
-                P[index] = [x[i], y[j]]
-            else:
-                P[index] = [x[i], y[j], z_max[i * s + j]]
+    P = controlNet(r, s, d)
 
-    return P
+    # NOTE that this is column-major for topohedral
+    return P.transpose(1, 0, 2).reshape(r * s, d)
 
 def getPoints2(p, q, d):
 
-    knotsu = getKnotsU(p)
-    knotsv = getKnotsV(q)
+    knotsu, knotsv, r, s = SURF_META[(p, q)]
+
+    P = controlNet(r, s, d)
 
-    m = len(knotsu)
-    r = m - p - 1
+    # NOTE this is the other way round as geomdl is row-major
+    return tuple(map(tuple, P.reshape(r * s, d).tolist()))
 
-    n = len(knotsv)
-    s = n - q - 1
+def controlNet(r, s, d):
 
     x = x_max[0:r]
     y = y_max[0:s]
 
-    if d == 2:
-        P = [[0 for _ in range(2)] for _ in range(r*s)]
-    elif d == 3:
-        P = [[0 for _ in range(3)] for _ in range(r*s)]
-
-    for i in range(r):
-        for j in range(s):
-            index = i * s + j # NOTE this is the other way round as geomdl is row-major
+    X = np.broadcast_to(x[:, None], (r, s))
+    Y = np.broadcast_to(y[None, :], (r, s))
 
-            if d == 2:
-                P[index] = [x[i], y[j]]
-            else:
-                P[index] = [x[i], y[j], z_max[index]]
+    if d == 2:
+        P = np.stack([X, Y], axis=-1)
+    else:
+        Z = z_max[0:r*s].reshape(r, s)
+        P = np.stack([X, Y, Z], axis=-1)
 
     return P
 
 def getWeights(p, q, tr):
 
-    knotsu = getKnotsU(p)
-    knotsv = getKnotsV(q)
+    knotsu, knotsv, r, s = SURF_META[(p, q)]
 
-    m = len(knotsu)
-    r = m - p - 1
+    w = weights_max[0:r*s].reshape(r, s)
 
-    n = len(knotsv)
-    s = n - q - 1
+    if tr:
+        return tuple(w.T.ravel().tolist())
 
-    nw = s * r
+    return tuple(w.ravel().tolist())
 
-    weights = weights_max[0:nw]
+@functools.lru_cache(maxsize=None)
+def getSurfaceData(p, q, d):
 
-    if tr: 
-        tmp_w = np.zeros((r, s))
-        for i in range(r):
-            for j in range(s):
-                tmp_w[i, j] = weights[i*s + j]
+    knotsu, knotsv, r, s = SURF_META[(p, q)]
 
-        tmp_w_tr = tmp_w.transpose()
-        weights = tmp_w_tr.flatten().tolist()
-        
-    return weights
+    points = np.asarray(getPoints2(p, q, d), dtype=np.float64)
+    if d == 2:
+        # geomdl surfaces are 3D, planar ones get a zero z column
+        points = np.pad(points, ((0, 0), (0, 1)))
+    points = tuple(map(tuple, points.tolist()))
 
-def getSurface(p, q, d):
+    weights = getWeights(p, q, False)
 
-    knotsu = getKnotsU(p)
-    m = len(knotsu)
-    r = m - p - 1
-    knotsv = getKnotsV(q)
-    n = len(knotsv)
-    s = n - q - 1
+    return knotsu, knotsv, r, s, points, weights
 
-    points = getPoints2(p, q, d)
-    if d == 2:
-        for pnt in points:
-            pnt.append(0.0)
+def getSurface(p, q, d):
 
-    weights = getWeights(p, q, False)
+    # geomdl mutates surfaces (e.g. knot insertion), so only the immutable
+    # data is cached and a fresh surface is built on every call
+    knotsu, knotsv, r, s, points, weights = getSurfaceData(p, q, d)
 
     surf = NURBS.Surface()
 
@@ -173,28 +146,413 @@ def getSurface(p, q, d):
 
     surf.ctrlpts_size_u = r
     surf.ctrlpts_size_v = s
-    surf.ctrlpts = points
+    surf.ctrlpts = list(points)
 
-    surf.weights = weights
+    surf.weights = list(weights)
 
     # Set knot vectors
-    surf.knotvector_u = knotsu
-    surf.knotvector_v = knotsv
+    surf.knotvector_u = knotsu.tolist()
+    surf.knotvector_v = knotsv.tolist()
 
     return surf
 
-def saveParams(data_out: dict):
+@functools.lru_cache(maxsize=None)
+def getSurfaceArrays(p, q, d):
+
+    knotsu, knotsv, r, s = SURF_META[(p, q)]
+
+    P = controlNet(r, s, d)
+    w = weights_max[0:r*s].reshape(r, s, 1)
+
+    # weighted control net, the last coordinate holds the weight
+    Pw = np.concatenate([P * w, w], axis=-1)
+
+    # the arrays are shared between callers through the cache
+    Pw.setflags(write=False)
+
+    return knotsu, knotsv, Pw
+
+# ------------------------------------------------------------------------------
+# NURBS surface kernels, following Piegl & Tiller "The NURBS Book".
+# geomdl is kept as the reference implementation, see checkSurfaceKernels.
+# ------------------------------------------------------------------------------
+
+@njit(cache=True)
+def find_span(n, p, u, U):
+
+    # A2.1, n is the index of the last control point
+    if u >= U[n + 1]:
+        return n
+
+    low = p
+    high = n + 1
+    mid = (low + high) // 2
+    while u < U[mid] or u >= U[mid + 1]:
+        if u < U[mid]:
+            high = mid
+        else:
+            low = mid
+        mid = (low + high) // 2
+
+    return mid
+
+@njit(cache=True, inline='always')
+def basis_funs(i, u, p, U):
+
+    # A2.2
+    N = np.empty(p + 1)
+    left = np.empty(p + 1)
+    right = np.empty(p + 1)
+
+    N[0] = 1.0
+    for j in range(1, p + 1):
+        left[j] = u - U[i + 1 - j]
+        right[j] = U[i + j] - u
+        saved = 0.0
+        for r in range(j):
+            temp = N[r] / (right[r + 1] + left[j - r])
+            N[r] = saved + right[r + 1] * temp
+            saved = left[j - r] * temp
+        N[j] = saved
+
+    return N
+
+@njit(cache=True, inline='always')
+def ders_basis_funs(i, u, p, n, U):
+
+    # A2.3, n <= p is the highest derivative computed
+    ndu = np.empty((p + 1, p + 1))
+    left = np.empty(p + 1)
+    right = np.empty(p + 1)
+
+    ndu[0, 0] = 1.0
+    for j in range(1, p + 1):
+        left[j] = u - U[i + 1 - j]
+        right[j] = U[i + j] - u
+        saved = 0.0
+        for r in range(j):
+            ndu[j, r] = right[r + 1] + left[j - r]
+            temp = ndu[r, j - 1] / ndu[j, r]
+            ndu[r, j] = saved + right[r + 1] * temp
+            saved = left[j - r] * temp
+        ndu[j, j] = saved
+
+    ders = np.zeros((n + 1, p + 1))
+    for j in range(p + 1):
+        ders[0, j] = ndu[j, p]
+
+    a = np.empty((2, p + 1))
+    for r in range(p + 1):
+        s1 = 0
+        s2 = 1
+        a[0, 0] = 1.0
+        for k in range(1, n + 1):
+            d = 0.0
+            rk = r - k
+            pk = p - k
+            if r >= k:
+                a[s2, 0] = a[s1, 0] / ndu[pk + 1, rk]
+                d = a[s2, 0] * ndu[rk, pk]
+            j1 = 1 if rk >= -1 else -rk
+            j2 = k - 1 if r - 1 <= pk else p - r
+            for j in range(j1, j2 + 1):
+                a[s2, j] = (a[s1, j] - a[s1, j - 1]) / ndu[pk + 1, rk + j]
+                d += a[s2, j] * ndu[rk + j, pk]
+            if r <= pk:
+                a[s2, k] = -a[s1, k - 1] / ndu[pk + 1, r]
+                d += a[s2, k] * ndu[r, pk]
+            ders[k, r] = d
+            s1, s2 = s2, s1
+
+    r = p
+    for k in range(1, n + 1):
+        for j in range(p + 1):
+            ders[k, j] *= r
+        r *= p - k
+
+    return ders
+
+@njit(cache=True)
+def binomial(n, k):
+
+    b = 1.0
+    for i in range(1, k + 1):
+        b = b * (n - k + i) / i
+
+    return b
+
+@njit(cache=True, inline='always')
+def surface_point_from_basis(p, q, uspan, Nu, vspan, Nv, Pw):
+
+    # A4.3 with the spans and basis functions already known
+    dw = Pw.shape[2]
+    Sw = np.zeros(dw)
+    for l in range(q + 1):
+        temp = np.zeros(dw)
+        for k in range(p + 1):
+            temp += Nu[k] * Pw[uspan - p + k, vspan - q + l]
+        Sw += Nv[l] * temp
+
+    return Sw[:dw - 1] / Sw[dw - 1]
+
+@njit(cache=True, inline='always')
+def surface_derivs_from_basis(p, q, k, uspan, Nu, vspan, Nv, Pw):
+
+    # A3.6 on the weighted control net, then A4.4 for the rational derivatives.
+    # Nu and Nv hold the basis function derivatives up to min(k, p) and
+    # min(k, q). SKL[kk, l] is the derivative kk times wrt u and l times wrt v.
+    # Like geomdl, the full (k+1)x(k+1) table is filled, including the mixed
+    # kk + l > k terms.
+    dw = Pw.shape[2]
+    dim = dw - 1
+    du = Nu.shape[0] - 1
+    dv = Nv.shape[0] - 1
+
+    Aw = np.zeros((k + 1, k + 1, dw))
+    for kk in range(du + 1):
+        temp = np.zeros((q + 1, dw))
+        for ss in range(q + 1):
+            for rr in range(p + 1):
+                temp[ss] += Nu[kk, rr] * Pw[uspan - p + rr, vspan - q + ss]
+        for l in range(dv + 1):
+            for ss in range(q + 1):
+                Aw[kk, l] += Nv[l, ss] * temp[ss]
+
+    SKL = np.zeros((k + 1, k + 1, dim))
+    for kk in range(k + 1):
+        for l in range(k + 1):
+            val = Aw[kk, l, :dim].copy()
+            for j in range(1, l + 1):
+                val -= binomial(l, j) * Aw[0, j, dim] * SKL[kk, l - j]
+            for i in range(1, kk + 1):
+                val -= binomial(kk, i) * Aw[i, 0, dim] * SKL[kk - i, l]
+                val2 = np.zeros(dim)
+                for j in range(1, l + 1):
+                    val2 += binomial(l, j) * Aw[i, j, dim] * SKL[kk - i, l - j]
+                val -= binomial(kk, i) * val2
+            SKL[kk, l] = val / Aw[0, 0, dim]
+
+    return SKL
+
+@njit(cache=True)
+def nurbs_surface_point(u, v, p, q, U, V, Pw):
+
+    r, s, dw = Pw.shape
+    uspan = find_span(r - 1, p, u, U)
+    vspan = find_span(s - 1, q, v, V)
+    Nu = basis_funs(uspan, u, p, U)
+    Nv = basis_funs(vspan, v, q, V)
+
+    return surface_point_from_basis(p, q, uspan, Nu, vspan, Nv, Pw)
+
+@njit(cache=True)
+def nurbs_surface_derivs(u, v, p, q, U, V, Pw, k):
+
+    r, s, dw = Pw.shape
+    uspan = find_span(r - 1, p, u, U)
+    vspan = find_span(s - 1, q, v, V)
+    Nu = ders_basis_funs(uspan, u, p, min(k, p), U)
+    Nv = ders_basis_funs(vspan, v, q, min(k, q), V)
+
+    return surface_derivs_from_basis(p, q, k, uspan, Nu, vspan, Nv, Pw)
+
+# ------------------------------------------------------------------------------
+# Batched evaluation. The spans and basis functions only depend on u (or v), so
+# they are computed once per distinct parameter value and shared by every point
+# using it, e.g. 10 + 10 evaluations instead of 2 x 100 on a 10x10 grid.
+# ------------------------------------------------------------------------------
+
+@njit(cache=True, inline='always')
+def basis_table(n, p, x, U):
+
+    spans = np.empty(x.shape[0], dtype=np.int64)
+    N = np.empty((x.shape[0], p + 1))
+    for i in range(x.shape[0]):
+        spans[i] = find_span(n, p, x[i], U)
+        N[i] = basis_funs(spans[i], x[i], p, U)
+
+    return spans, N
+
+@njit(cache=True, inline='always')
+def ders_basis_table(n, p, k, x, U):
+
+    spans = np.empty(x.shape[0], dtype=np.int64)
+    N = np.empty((x.shape[0], min(k, p) + 1, p + 1))
+    for i in range(x.shape[0]):
+        spans[i] = find_span(n, p, x[i], U)
+        N[i] = ders_basis_funs(spans[i], x[i], p, min(k, p), U)
+
+    return spans, N
+
+@njit(cache=True)
+def unique_params(x):
+
+    # distinct values of x and the index of each entry among them
+    vals = np.unique(x)
+    return vals, np.searchsorted(vals, x)
+
+@functools.lru_cache(maxsize=None)
+def getSurfaceKernels(p, q):
+
+    # Batched kernels specialised for degrees (p, q). numba freezes the closure
+    # variables p and q as constants, and the degree dependent helpers above are
+    # inlined, so the basis function loops have fixed trip counts and the work
+    # arrays fixed sizes. Each variant is compiled on its first call and cached
+    # on disk like the other kernels.
+
+    @njit(parallel=True, cache=True)
+    def points(uv, U, V, Pw):
+
+        r, s, dw = Pw.shape
+        us, iu = unique_params(uv[:, 0])
+        vs, iv = unique_params(uv[:, 1])
+        uspans, Nu = basis_table(r - 1, p, us, U)
+        vspans, Nv = basis_table(s - 1, q, vs, V)
+
+        num_points = uv.shape[0]
+        S = np.empty((num_points, dw - 1))
+        for j in prange(num_points):
+            a = iu[j]
+            b = iv[j]
+            S[j] = surface_point_from_basis(p, q, uspans[a], Nu[a], vspans[b], Nv[b], Pw)
+
+        return S
+
+    @njit(parallel=True, cache=True)
+    def derivs(uv, U, V, Pw, k):
+
+        r, s, dw = Pw.shape
+        us, iu = unique_params(uv[:, 0])
+        vs, iv = unique_params(uv[:, 1])
+        uspans, Nu = ders_basis_table(r - 1, p, k, us, U)
+        vspans, Nv = ders_basis_table(s - 1, q, k, vs, V)
+
+        num_points = uv.shape[0]
+        ders = np.empty((num_points, k + 1, k + 1, dw - 1))
+        for j in prange(num_points):
+            a = iu[j]
+            b = iv[j]
+            ders[j] = surface_derivs_from_basis(p, q, k, uspans[a], Nu[a], vspans[b], Nv[b], Pw)
+
+        return ders
+
+    return points, derivs
+
+def nurbs_surface_points(uv, p, q, U, V, Pw):
+
+    return getSurfaceKernels(p, q)[0](uv, U, V, Pw)
+
+def nurbs_surface_derivs_list(uv, p, q, U, V, Pw, k):
+
+    return getSurfaceKernels(p, q)[1](uv, U, V, Pw, k)
+
+@njit(parallel=True, cache=True)
+def nurbs_surface_points_multi(uv, degrees, knots, knot_offsets, Pw, Pw_offsets, shapes):
+
+    # Evaluates several surfaces at once, surface i has degrees degrees[i],
+    # u knots knots[knot_offsets[i, 0]:knot_offsets[i, 1]], v knots
+    # knots[knot_offsets[i, 1]:knot_offsets[i, 2]] and a weighted control net
+    # Pw[Pw_offsets[i]:Pw_offsets[i + 1]] of shape shapes[i]
+    num_surfs = degrees.shape[0]
+    num_points = uv.shape[0]
+    us, iu = unique_params(uv[:, 0])
+    vs, iv = unique_params(uv[:, 1])
+
+    S = np.empty((num_surfs, num_points, shapes[0, 2] - 1))
+    for i in prange(num_surfs):
+        p = degrees[i, 0]
+        q = degrees[i, 1]
+        U = knots[knot_offsets[i, 0]:knot_offsets[i, 1]]
+        V = knots[knot_offsets[i, 1]:knot_offsets[i, 2]]
+        Pwi = Pw[Pw_offsets[i]:Pw_offsets[i + 1]].reshape((shapes[i, 0], shapes[i, 1], shapes[i, 2]))
+        uspans, Nu = basis_table(shapes[i, 0] - 1, p, us, U)
+        vspans, Nv = basis_table(shapes[i, 1] - 1, q, vs, V)
+        for j in range(num_points):
+            a = iu[j]
+            b = iv[j]
+            S[i, j] = surface_point_from_basis(p, q, uspans[a], Nu[a], vspans[b], Nv[b], Pwi)
+
+    return S
+
+@njit(parallel=True, cache=True)
+def nurbs_surface_derivs_multi(uv, degrees, knots, knot_offsets, Pw, Pw_offsets, shapes, k):
+
+    # same layout as nurbs_surface_points_multi
+    num_surfs = degrees.shape[0]
+    num_points = uv.shape[0]
+    us, iu = unique_params(uv[:, 0])
+    vs, iv = unique_params(uv[:, 1])
+
+    ders = np.empty((num_surfs, num_points, k + 1, k + 1, shapes[0, 2] - 1))
+    for i in prange(num_surfs):
+        p = degrees[i, 0]
+        q = degrees[i, 1]
+        U = knots[knot_offsets[i, 0]:knot_offsets[i, 1]]
+        V = knots[knot_offsets[i, 1]:knot_offsets[i, 2]]
+        Pwi = Pw[Pw_offsets[i]:Pw_offsets[i + 1]].reshape((shapes[i, 0], shapes[i, 1], shapes[i, 2]))
+        uspans, Nu = ders_basis_table(shapes[i, 0] - 1, p, k, us, U)
+        vspans, Nv = ders_basis_table(shapes[i, 1] - 1, q, k, vs, V)
+        for j in range(num_points):
+            a = iu[j]
+            b = iv[j]
+            ders[i, j] = surface_derivs_from_basis(p, q, k, uspans[a], Nu[a], vspans[b], Nv[b], Pwi)
+
+    return ders
+
+@functools.lru_cache(maxsize=None)
+def getSurfacePack(d):
+
+    # flattens the surfaces of all orders in dimension d into the layout
+    # expected by the *_multi kernels
+    degrees = np.array(orders, dtype=np.int64)
+    knots = []
+    knot_offsets = np.zeros((len(orders), 3), dtype=np.int64)
+    Pw = []
+    Pw_offsets = np.zeros(len(orders) + 1, dtype=np.int64)
+    shapes = np.zeros((len(orders), 3), dtype=np.int64)
+
+    offset = 0
+    for i, ord in enumerate(orders):
+        knotsu, knotsv, Pwi = getSurfaceArrays(ord[0], ord[1], d)
+        knots += [knotsu, knotsv]
+        knot_offsets[i] = [offset, offset + len(knotsu), offset + len(knotsu) + len(knotsv)]
+        offset = knot_offsets[i, 2]
+        Pw.append(Pwi.ravel())
+        Pw_offsets[i + 1] = Pw_offsets[i] + Pwi.size
+        shapes[i] = Pwi.shape
+
+    pack = (degrees, np.concatenate(knots), knot_offsets, np.concatenate(Pw), Pw_offsets, shapes)
+    for arr in pack:
+        arr.setflags(write=False)
+
+    return pack
+
+def checkSurfaceKernels(uv: np.ndarray):
+
+    max_deriv = 4
+    uv_list = uv.tolist()
+
+    for d in range(2, 4):
+        for ord in orders:
+            p = ord[0]
+            q = ord[1]
+            surf = getSurface(p, q, d)
+            knotsu, knotsv, Pw = getSurfaceArrays(p, q, d)
+
+            P_ref = np.array(surf.evaluate_list(uv_list))[:, :d]
+            P = nurbs_surface_points(uv, p, q, knotsu, knotsv, Pw)
+            np.testing.assert_allclose(P, P_ref, rtol=1e-10, atol=1e-10)
+
+            ders_ref = np.array([surf.derivatives(u, v, max_deriv) for u, v in uv])[..., :d]
+            ders = nurbs_surface_derivs_list(uv, p, q, knotsu, knotsv, Pw, max_deriv)
+            # high order derivatives are large, so compare relative to the largest
+            np.testing.assert_allclose(ders, ders_ref, rtol=0, atol=1e-10 * np.abs(ders_ref).max())
 
-    nu = 10
-    nv = 10
-    NP = nu * nv
-    u = linspace(0, 1, nu)
-    v = linspace(0, 1, nv)
-    S = np.array(cartProd(u, v))
+def saveParams(data_out: dict, uv: np.ndarray):
 
     data_out["uv"] = dict()
     data_out["uv"]["description"] = "Set of parameter pairs (u, v), both dimensions linearly spaced from 0 to 1"
-    data_out["uv"]["values"] = S.tolist()
+    data_out["uv"]["values"] = uv
 
 def save_orders(data_out: dict):
 
@@ -234,25 +592,14 @@ def saveCtrlpts(data_out: dict):
             data_out[cpoints_p_q_d]["description"] = f"Control points for NURBS surface of order (p={ord[0]}, q={ord[1]}), dimension d={d}"
             data_out[cpoints_p_q_d]["values"] = cpoints
 
-def saveSurfacePoints(data_out: dict):
-
-    nu = 10
-    nv = 10
-    NP = nu * nv
-    u = linspace(0, 1, nu)
-    v = linspace(0, 1, nv)
-    S = cartProd(u, v)
+def saveSurfacePoints(data_out: dict, uv: np.ndarray):
 
     for d in range(2, 4):
+        points = nurbs_surface_points_multi(uv, *getSurfacePack(d))
         for i, ord in enumerate(orders):
             p = ord[0]
             q = ord[1]
-            surface = getSurface(p, q, d)
-            P = surface.evaluate_list(S)
-
-            if d == 2:
-                for pnt in P:
-                    pnt.pop()
+            P = points[i]
 
             dataset = "points_d%i_p%i_q%i" % (d, p, q)
             data_out[dataset] = dict()
@@ -262,41 +609,20 @@ def saveSurfacePoints(data_out: dict):
             # print("------------------------------------- {} {} {}".format(d, p, q))
             # print(P)
 
-def saveDerivatives(data_out: dict):
+def saveDerivatives(data_out: dict, uv: np.ndarray):
 
-    nu = 10
-    nv = 10
-    num_points = nu * nv
-    u = linspace(0, 1, nu)
-    v = linspace(0, 1, nv)
-    S = np.array(cartProd(u, v))
+    max_deriv = 4
 
     for d in range(2, 4):
-        for ord in orders:
+        all_ders = nurbs_surface_derivs_multi(uv, *getSurfacePack(d), max_deriv)
+        for i, ord in enumerate(orders):
             p = ord[0]
             q = ord[1]
-            max_deriv = 4
-            surf = getSurface(p, q, d)
-
-            derivs = [[0.0 for _ in range(3)] for _ in range(((max_deriv + 1)**2) * num_points)]
+            ders = all_ders[i]
 
-            for j, Sj in enumerate(S):
-                u = Sj[0]
-                v = Sj[1]
-                SKL = surf.derivatives(u, v, max_deriv)
+            # each point is stored as SKL[jj][ii] at row ii * (max_deriv+1) + jj
+            derivs = ders.transpose(0, 2, 1, 3).reshape(-1, d)
 
-                start = j * (max_deriv+1) * (max_deriv+1)
-
-                for ii in range(max_deriv+1):
-                    for jj in range(max_deriv+1):
-
-                        index = start + ii * (max_deriv+1) + jj
-                        der_j = SKL[jj][ii]
-                        if d == 2:
-                            der_j.pop()
-
-                        derivs[index] = der_j
-            
             dataset = "ders_d%i_p%i_q%i" % (d, p, q)    
             data_out[dataset] = dict()
             data_out[dataset]["description"] = f"Surface derivatives for NURBS surface of order (p={p}, q={q}), dimension d={d}"
@@ -306,77 +632,52 @@ def saveDerivatives(data_out: dict):
 
 
 
-def saveTangents():
+def saveTangents(f: h5py.File, uv: np.ndarray):
 
-    f = h5py.File(file_name, 'a')
     grp = f.create_group('surface_tangents')
 
-    nu = 10
-    nv = 10
-    NP = nu * nv
-    u = linspace(0, 1, nu)
-    v = linspace(0, 1, nv)
-    S = np.array(cartProd(u, v))
+    NP = uv.shape[0]
 
 
     for i, ord in enumerate(orders):
 
         p = ord[0]
         q = ord[1]
-        surf = getSurface(p, q, 3)
-
-        tani = np.zeros((3, 3))
-        tangents = np.zeros((NP * 2, 3))
+        knotsu, knotsv, Pw = getSurfaceArrays(p, q, 3)
+        ders = nurbs_surface_derivs_list(uv, p, q, knotsu, knotsv, Pw, 1)
 
-        dset = grp.create_dataset('tangents%i' % i,
-                                    (3, NP * 2),
-                                    np.double)
+        # rows alternate between the u and v tangent of each point
+        tangents = np.stack([ders[:, 1, 0], ders[:, 0, 1]], axis=1).reshape(NP * 2, 3)
 
-        for j, Sj in enumerate(S):
+        writeTransposed(grp, 'tangents%i' % i, tangents)
 
-            tmp = operations.tangent(surf, Sj, normalize = False)
-            tangents[2*j, :] = tmp[1]
-            tangents[2*j+1, :] = tmp[2]
+def saveNormals(f: h5py.File, uv: np.ndarray):
 
-        dset[:,:] = tangents.transpose()
-
-def saveNormals():
-
-    f = h5py.File(file_name, 'a')
     grp = f.create_group('surface_normals')
 
-    nu = 10
-    nv = 10
-    NP = nu * nv
-    u = linspace(0, 1, nu)
-    v = linspace(0, 1, nv)
-    S = np.array(cartProd(u, v))
+    NP = uv.shape[0]
 
 
     for i, ord in enumerate(orders):
 
         p = ord[0]
         q = ord[1]
-        surf = getSurface(p, q, 3)
+        knotsu, knotsv, Pw = getSurfaceArrays(p, q, 3)
+        ders = nurbs_surface_derivs_list(uv, p, q, knotsu, knotsv, Pw, 1)
 
-        normi = np.zeros((2, 3))
-        normals = np.zeros((NP, 3))
+        normals = np.cross(ders[:, 1, 0], ders[:, 0, 1])
 
-        dset = grp.create_dataset('normals%i' % i,
-                                    (3, NP),
-                                    np.double)
+        writeTransposed(grp, 'normals%i' % i, normals)
 
-        for j, Sj in enumerate(S):
 
-            tmp = operations.normal(surf, Sj, normalize = False)
-            normals[j, :] = tmp[1]
+def writeTransposed(grp, name, arr, dtype=np.float64):
 
-        dset[:,:] = normals.transpose()
+    # vectors and scalars are stored as a single row, matrices transposed
+    data = np.atleast_2d(np.asarray(arr, dtype=dtype).transpose())
+    grp.create_dataset(name, data=np.ascontiguousarray(data))
 
+def insertKnotU(f: h5py.File):
 
-def insertKnotU():
-
-    f = h5py.File(file_name, 'a')
     grp = f.create_group('knot_insertion')
     p = orders[4][0]
     q = orders[4][1]
@@ -394,30 +695,12 @@ def insertKnotU():
 
     grp1 = grp.create_group('insertionu1')
 
-    dset = grp1.create_dataset('knot', (1,1), dtype = np.double)
-    dset[:,:] = u1
-
-    dset = grp1.create_dataset('r', (1,1), np.int)
-    dset[:,:] = r1
-
-    dset = grp1.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-    dset = grp1.create_dataset('points', (points1.shape[1], points1.shape[0]),
-                                                dtype = np.double)
-    dset[:,:] = points1.transpose()
-
-    dset = grp1.create_dataset('pointsw', (pointsw1.shape[1], pointsw1.shape[0]),
-                                                dtype = np.double)
-
-    dset[:,:] = pointsw1.transpose()
-
-    dset = grp1.create_dataset('weights', (1, weights1.shape[0]),
-                                                dtype = np.double)
-
-    dset[:,:] = weights1.transpose()
+    writeTransposed(grp1, 'knot', u1)
+    writeTransposed(grp1, 'r', r1, np.int64)
+    writeTransposed(grp1, 'knots', knots1)
+    writeTransposed(grp1, 'points', points1)
+    writeTransposed(grp1, 'pointsw', pointsw1)
+    writeTransposed(grp1, 'weights', weights1)
 
     # ......................................................... insertion2
     surf1 = getSurface(p, q, 3)
@@ -432,35 +715,16 @@ def insertKnotU():
 
     grp1 = grp.create_group('insertionu2')
 
-    dset = grp1.create_dataset('knot', (1,1), dtype = np.double)
-    dset[:,:] = u1
-
-    dset = grp1.create_dataset('r', (1,1), np.int)
-    dset[:,:] = r1
-
-    dset = grp1.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-    dset = grp1.create_dataset('points', (points1.shape[1], points1.shape[0]),
-                                                dtype = np.double)
-    dset[:,:] = points1.transpose()
+    writeTransposed(grp1, 'knot', u1)
+    writeTransposed(grp1, 'r', r1, np.int64)
+    writeTransposed(grp1, 'knots', knots1)
+    writeTransposed(grp1, 'points', points1)
+    writeTransposed(grp1, 'pointsw', pointsw1)
+    writeTransposed(grp1, 'weights', weights1)
 
-    dset = grp1.create_dataset('pointsw', (pointsw1.shape[1], pointsw1.shape[0]),
-                                                dtype = np.double)
 
-    dset[:,:] = pointsw1.transpose()
+def insertKnotV(f: h5py.File):
 
-    dset = grp1.create_dataset('weights', (1, weights1.shape[0]),
-                                                dtype = np.double)
-
-    dset[:,:] = weights1.transpose()
-
-
-def insertKnotV():
-
-    f = h5py.File(file_name, 'a')
     grp = f['knot_insertion']
     p = orders[4][0]
     q = orders[4][1]
@@ -478,30 +742,12 @@ def insertKnotV():
 
     grp1 = grp.create_group('insertionv1')
 
-    dset = grp1.create_dataset('knot', (1,1), dtype = np.double)
-    dset[:,:] = v1
-
-    dset = grp1.create_dataset('r', (1,1), np.int)
-    dset[:,:] = r1
-
-    dset = grp1.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-    dset = grp1.create_dataset('points', (points1.shape[1], points1.shape[0]),
-                                                dtype = np.double)
-    dset[:,:] = points1.transpose()
-
-    dset = grp1.create_dataset('pointsw', (pointsw1.shape[1], pointsw1.shape[0]),
-                                                dtype = np.double)
-
-    dset[:,:] = pointsw1.transpose()
-
-    dset = grp1.create_dataset('weights', (1, weights1.shape[0]),
-                                                dtype = np.double)
-
-    dset[:,:] = weights1.transpose()
+    writeTransposed(grp1, 'knot', v1)
+    writeTransposed(grp1, 'r', r1, np.int64)
+    writeTransposed(grp1, 'knots', knots1)
+    writeTransposed(grp1, 'points', points1)
+    writeTransposed(grp1, 'pointsw', pointsw1)
+    writeTransposed(grp1, 'weights', weights1)
 
     # ......................................................... insertion2
     surf1 = getSurface(p, q, 3)
@@ -515,36 +761,17 @@ def insertKnotV():
     weights1 = np.array(surf1.weights)
 
     grp1 = grp.create_group('insertionv2')
-    dset = grp1.create_dataset('knot', (1,1), dtype = np.double)
-    dset[:,:] = v1
-
-    dset = grp1.create_dataset('r', (1,1), np.int)
-    dset[:,:] = r1
-
-    dset = grp1.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-    dset = grp1.create_dataset('points', (points1.shape[1], points1.shape[0]),
-                                                dtype = np.double)
-    dset[:,:] = points1.transpose()
-
-    dset = grp1.create_dataset('pointsw', (pointsw1.shape[1], pointsw1.shape[0]),
-                                                dtype = np.double)
-
-    dset[:,:] = pointsw1.transpose()
-
-    dset = grp1.create_dataset('weights', (1, weights1.shape[0]),
-                                                dtype = np.double)
+    writeTransposed(grp1, 'knot', v1)
+    writeTransposed(grp1, 'r', r1, np.int64)
+    writeTransposed(grp1, 'knots', knots1)
+    writeTransposed(grp1, 'points', points1)
+    writeTransposed(grp1, 'pointsw', pointsw1)
+    writeTransposed(grp1, 'weights', weights1)
 
-    dset[:,:] = weights1.transpose()
 
 
+def splitSurfaceU(f: h5py.File):
 
-def splitSurfaceU():
-
-    f = h5py.File(file_name, 'a')
     grp = f.create_group('surface_splitting')
     p = orders[4][0]
     q = orders[4][1]
@@ -566,49 +793,17 @@ def splitSurfaceU():
     grp0 = grp.create_group('splitu1/surface0')
     grp1 = grp.create_group('splitu1/surface1')
 
-    dset = grp0.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-
-    dset = grp0.create_dataset('points',
-                                (points1.shape[1], points1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points1.transpose()
-
-    dset = grp0.create_dataset('pointsw',
-                                (pointsw1.shape[1], pointsw1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw1.transpose()
-
-    dset = grp0.create_dataset('weights',
-                                (1, weights1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights1.transpose()
+    writeTransposed(grp0, 'knots', knots1)
+    writeTransposed(grp0, 'points', points1)
+    writeTransposed(grp0, 'pointsw', pointsw1)
+    writeTransposed(grp0, 'weights', weights1)
 
 
     # -------
-    dset = grp1.create_dataset('knots',
-                                (1, knots2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots2.transpose()
-
-
-    dset = grp1.create_dataset('points',
-                                (points2.shape[1], points2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points2.transpose()
-
-    dset = grp1.create_dataset('pointsw',
-                                (pointsw2.shape[1], pointsw2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw2.transpose()
-
-    dset = grp1.create_dataset('weights',
-                                (1, weights2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights2.transpose()
+    writeTransposed(grp1, 'knots', knots2)
+    writeTransposed(grp1, 'points', points2)
+    writeTransposed(grp1, 'pointsw', pointsw2)
+    writeTransposed(grp1, 'weights', weights2)
 
 
     # ......................................................... insertion2
@@ -628,57 +823,24 @@ def splitSurfaceU():
     grp0 = grp.create_group('splitu2/surface0')
     grp1 = grp.create_group('splitu2/surface1')
 
-    dset = grp0.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-
-    dset = grp0.create_dataset('points',
-                                (points1.shape[1], points1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points1.transpose()
-
-    dset = grp0.create_dataset('pointsw',
-                                (pointsw1.shape[1], pointsw1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw1.transpose()
-
-    dset = grp0.create_dataset('weights',
-                                (1, weights1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights1.transpose()
+    writeTransposed(grp0, 'knots', knots1)
+    writeTransposed(grp0, 'points', points1)
+    writeTransposed(grp0, 'pointsw', pointsw1)
+    writeTransposed(grp0, 'weights', weights1)
 
 
     # -------
-    dset = grp1.create_dataset('knots',
-                                (1, knots2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots2.transpose()
-
-
-    dset = grp1.create_dataset('points',
-                                (points2.shape[1], points2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points2.transpose()
-
-    dset = grp1.create_dataset('pointsw',
-                                (pointsw2.shape[1], pointsw2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw2.transpose()
-
-    dset = grp1.create_dataset('weights',
-                                (1, weights2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights2.transpose()
+    writeTransposed(grp1, 'knots', knots2)
+    writeTransposed(grp1, 'points', points2)
+    writeTransposed(grp1, 'pointsw', pointsw2)
+    writeTransposed(grp1, 'weights', weights2)
 
 
 
 
 
-def splitSurfaceV():
+def splitSurfaceV(f: h5py.File):
 
-    f = h5py.File(file_name, 'a')
     grp = f['surface_splitting']
     p = orders[4][0]
     q = orders[4][1]
@@ -700,49 +862,17 @@ def splitSurfaceV():
     grp0 = grp.create_group('splitv1/surface0')
     grp1 = grp.create_group('splitv1/surface1')
 
-    dset = grp0.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-
-    dset = grp0.create_dataset('points',
-                                (points1.shape[1], points1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points1.transpose()
-
-    dset = grp0.create_dataset('pointsw',
-                                (pointsw1.shape[1], pointsw1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw1.transpose()
-
-    dset = grp0.create_dataset('weights',
-                                (1, weights1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights1.transpose()
+    writeTransposed(grp0, 'knots', knots1)
+    writeTransposed(grp0, 'points', points1)
+    writeTransposed(grp0, 'pointsw', pointsw1)
+    writeTransposed(grp0, 'weights', weights1)
 
 
     # -------
-    dset = grp1.create_dataset('knots',
-                                (1, knots2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots2.transpose()
-
-
-    dset = grp1.create_dataset('points',
-                                (points2.shape[1], points2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points2.transpose()
-
-    dset = grp1.create_dataset('pointsw',
-                                (pointsw2.shape[1], pointsw2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw2.transpose()
-
-    dset = grp1.create_dataset('weights',
-                                (1, weights2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights2.transpose()
+    writeTransposed(grp1, 'knots', knots2)
+    writeTransposed(grp1, 'points', points2)
+    writeTransposed(grp1, 'pointsw', pointsw2)
+    writeTransposed(grp1, 'weights', weights2)
 
 
     # ......................................................... insertion2
@@ -762,194 +892,122 @@ def splitSurfaceV():
     grp0 = grp.create_group('splitv2/surface0')
     grp1 = grp.create_group('splitv2/surface1')
 
-    dset = grp0.create_dataset('knots',
-                                (1, knots1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots1.transpose()
-
-
-    dset = grp0.create_dataset('points',
-                                (points1.shape[1], points1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points1.transpose()
-
-    dset = grp0.create_dataset('pointsw',
-                                (pointsw1.shape[1], pointsw1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw1.transpose()
-
-    dset = grp0.create_dataset('weights',
-                                (1, weights1.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights1.transpose()
+    writeTransposed(grp0, 'knots', knots1)
+    writeTransposed(grp0, 'points', points1)
+    writeTransposed(grp0, 'pointsw', pointsw1)
+    writeTransposed(grp0, 'weights', weights1)
 
 
     # -------
-    dset = grp1.create_dataset('knots',
-                                (1, knots2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = knots2.transpose()
-
+    writeTransposed(grp1, 'knots', knots2)
+    writeTransposed(grp1, 'points', points2)
+    writeTransposed(grp1, 'pointsw', pointsw2)
+    writeTransposed(grp1, 'weights', weights2)
 
-    dset = grp1.create_dataset('points',
-                                (points2.shape[1], points2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = points2.transpose()
 
-    dset = grp1.create_dataset('pointsw',
-                                (pointsw2.shape[1], pointsw2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = pointsw2.transpose()
 
-    dset = grp1.create_dataset('weights',
-                                (1, weights2.shape[0]),
-                                dtype = np.double)
-    dset[:,:] = weights2.transpose()
-
-
-
-def saveIntegration():
+def saveIntegration(f: h5py.File):
 
     p = 2
     q = 2
-    knotsu = [0, 0, 0, 0.34, 0.57, 0.86, 1,1,1]
-    knotsv = [0, 0, 0, 0.124, 0.45, 0.73, 1,1,1]
+    knotsu = np.array([0, 0, 0, 0.34, 0.57, 0.86, 1,1,1], dtype=np.float64)
+    knotsv = np.array([0, 0, 0, 0.124, 0.45, 0.73, 1,1,1], dtype=np.float64)
     r = len(knotsu) - (p + 1)
     s = len(knotsv) - (q + 1)
-    points = [[0 for i in range(3)] for i in range(r*s)]
-    for i in range(r):
-        for j in range(s):
-            index = i*s + j
-            points[index] = [i, j, math.sin(i)*math.cos(j)]
-
-    weights = [1 for i in range(r*s)]
-
-
-    surf = NURBS.Surface()
-    surf.degree_u = p
-    surf.degree_v = q
-
-    surf.ctrlpts_size_u = r
-    surf.ctrlpts_size_v = s
-    surf.ctrlpts = points
-
-    surf.weights = weights
-
-    surf.knotvector_u = knotsu
-    surf.knotvector_v = knotsv
-
-
-    knotsu1 = np.array(surf.knotvector_u)
-    knotsv1 = np.array(surf.knotvector_v)
-    points1 = np.array(surf.ctrlpts)
-    weights1 = np.array(surf.weights)
-
-    def jacobian(u,v):
-        s = [u,v]
-        tmp = operations.tangent(surf, s, normalize = False)
-        tanu = tmp[1]
-        tanv = tmp[2]
-        tangents = np.array([tanu, tanv])
-        jac_mat = np.matmul(tangents, tangents.transpose())
-        jac = math.sqrt(np.linalg.det(jac_mat))
-        return jac
 
+    i = np.arange(r, dtype=np.float64)[:, None]
+    j = np.arange(s, dtype=np.float64)[None, :]
+    points = np.stack(np.broadcast_arrays(i, j, np.sin(i) * np.cos(j)), axis=-1)
+    weights = np.ones((r, s, 1))
+    Pw = np.concatenate([points * weights, weights], axis=-1)
 
     def fcn3d(x, y, z):
-        val = x * y * z * (math.exp(y)/500)
+        val = x * y * z * (np.exp(y)/500)
         return val
 
-    def integrand(v,u):
-        s = [u,v]
-        X = surf.evaluate_single(s)
-        x = X[0]
-        y = X[1]
-        z = X[2]
-        jac = jacobian(u,v)
-        f = jac * fcn3d(x,y,z)
-        return f
-
-
-    def ylow(x):
-        return 0
-
-    def yhigh(x):
-        return 1
-
-    If, err = sci.dblquad(integrand, 0, 1, ylow, yhigh, epsabs = 1e-3, epsrel = 1e-3)
+    # the integrand is smooth inside each knot span, so a Gauss-Legendre rule
+    # per span converges quickly where a single rule over [0, 1] does not
+    u, wu = gaussLegendreKnots(knotsu, 8)
+    v, wv = gaussLegendreKnots(knotsv, 8)
+    ders = nurbs_surface_derivs_list(cartProd(u, v), p, q, knotsu, knotsv, Pw, 1)
+
+    X = ders[:, 0, 0]
+    tanu = ders[:, 1, 0]
+    tanv = ders[:, 0, 1]
+    # determinant of the 2x2 Gram matrix of the tangents
+    a = np.einsum('ij,ij->i', tanu, tanu)
+    b = np.einsum('ij,ij->i', tanv, tanv)
+    c = np.einsum('ij,ij->i', tanu, tanv)
+    jac = np.sqrt(a * b - c * c)
+
+    vals = (jac * fcn3d(X[:, 0], X[:, 1], X[:, 2])).reshape(len(u), len(v))
+    If = np.einsum('i,j,ij->', wu, wv, vals)
     print(If)
 
-    f = h5py.File(file_name, 'a')
     grp = f.create_group('integration')
 
-    dset = grp.create_dataset('p', (1,0), np.int)
-    dset[0] = p
-
-    dset = grp.create_dataset('q', (1,0), np.int)
-    dset[0] = q
-
-    dset = grp.create_dataset('knotsu', (1, knotsu1.shape[0]), np.double)
-    dset[:,:] = knotsu1.transpose()
-
-    dset = grp.create_dataset('knotsv', (1, knotsv1.shape[0]), np.double)
-    dset[:,:] = knotsv1.transpose()
+    writeTransposed(grp, 'p', p, np.int64)
+    writeTransposed(grp, 'q', q, np.int64)
 
-    dset = grp.create_dataset('points', (points1.shape[1], points1.shape[0]), np.double)
-    dset[:,:] = points1.transpose()
+    writeTransposed(grp, 'knotsu', knotsu)
+    writeTransposed(grp, 'knotsv', knotsv)
+    writeTransposed(grp, 'points', points.reshape(r * s, 3))
+    writeTransposed(grp, 'weights', weights.ravel())
 
-    dset = grp.create_dataset('weights', (1, weights1.shape[0]), np.double)
-    dset[:,:] = weights1.transpose()
-
-    dset = grp.create_dataset('integral', (1,), np.double)
-    dset[0] = If
+    grp.create_dataset('integral', data=np.array([If], dtype=np.float64))
 
 
 
 
 def cartProd(x, y):
 
-    n = len(x)
-    m = len(y)
-
-    N = n * m
-    P = [[0 for _ in range(2)] for _ in range(N)]
+    X, Y = np.meshgrid(x, y, indexing='ij')
+    return np.stack([X.ravel(), Y.ravel()], axis=1)
 
-    ii = 0
-    for i in range(n):
-        for j in range(m):
+def gaussLegendreKnots(knots, n):
 
-            P[ii] = [x[i], y[j]]
-            ii = ii + 1
+    # n-point Gauss-Legendre nodes and weights on every non-empty knot span
+    xi, wi = np.polynomial.legendre.leggauss(n)
+    k = np.unique(knots)
+    a = k[:-1, None]
+    h = (k[1:] - k[:-1])[:, None]
 
-    return P
+    x = a + 0.5 * h * (xi + 1.0)
+    w = 0.5 * h * wi
 
-def linspace(a, b, n):
+    return x.ravel(), w.ravel()
 
-    dx = (b - a) / (n-1)
-    x = [0 for _ in range(n)]
-    x[0] = a
-    x[n-1] = b
-    for i in range(1, n-1):
-        x[i] = x[i-1] + dx
 
-    return x
 
 
+def saveHdf5(uv: np.ndarray):
 
+    with h5py.File(h5_file_name, 'w') as f:
+        saveTangents(f, uv)
+        saveNormals(f, uv)
+        insertKnotU(f)
+        insertKnotV(f)
+        splitSurfaceU(f)
+        splitSurfaceV(f)
+        saveIntegration(f)
 
 def main():
 
 
+    u = np.linspace(0.0, 1.0, 10)
+    v = np.linspace(0.0, 1.0, 10)
+    uv = cartProd(u, v)
+
     data_out = dict()
-    saveParams(data_out)
+    saveParams(data_out, uv)
     saveKnots(data_out)
     saveWeights(data_out)
     saveCtrlpts(data_out)
-    saveSurfacePoints(data_out)
-    saveDerivatives(data_out)
+    saveSurfacePoints(data_out, uv)
+    saveDerivatives(data_out, uv)
 
-    with open(file_name, 'w') as f: 
-        json.dump(data_out, f, indent=4)
+    with open(file_name, 'wb') as f:
+        f.write(orjson.dumps(data_out, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_INDENT_2))
 
 
     surf1 = getSurface(1, 2, 3)
@@ -958,15 +1016,10 @@ def main():
         for j in range(surf1.ctrlpts_size_v):
             print('[{}][{}] = {}'.format(i, j, surf1.ctrlpts2d[i][j]))
 
+    # checkSurfaceKernels(uv)
     # saveSurfacePoints()
     # saveDerivatives()
-    # saveTangents()
-    # saveNormals()
-    # insertKnotU()
-    # insertKnotV()
-    # splitSurfaceU()
-    # splitSurfaceV()
-    # saveIntegration()
+    # saveHdf5(uv)
 
 
 